@@ -0,0 +1,285 @@
+import os
+import uuid
+import asyncio
+import logging
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import text, bindparam
+from app.db import engine, UPLOAD_DIR
+
+logger = logging.getLogger("insighthub.cleanup")
+
+# Uploads handled per batch; keeps each DROP statement and metadata DELETE small.
+# MySQL commits DROP TABLE implicitly, so the metadata rows are deleted (and committed) first:
+# a failed DROP then leaves an unreferenced data_ table for the retention sweep, never a dangling row.
+DELETE_BATCH_SIZE = int(os.getenv("DELETE_BATCH_SIZE", "50"))
+
+# parse_with_header inserts the metadata row with an empty table_name and fills it in once the
+# table exists; such rows younger than this are treated as in-flight and left alone
+PENDING_PARSE_GRACE_MINUTES = int(os.getenv("PENDING_PARSE_GRACE_MINUTES", "10"))
+
+# Retention policy: uploads older than this many days are reclaimed automatically (0 disables it)
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "0"))
+
+# Upper bound for age filters; larger values overflow datetime arithmetic
+MAX_AGE_DAYS = 36500
+# Clamped so a zero or negative setting cannot turn the sweep into a tight loop against the database
+MIN_RETENTION_INTERVAL_HOURS = 1.0
+RETENTION_INTERVAL_HOURS = max(float(os.getenv("RETENTION_INTERVAL_HOURS", "24")), MIN_RETENTION_INTERVAL_HOURS)
+
+# In-memory registry of deletion jobs, keyed by job id; finished jobs expire after JOB_TTL_HOURS
+JOB_TTL_HOURS = float(os.getenv("DELETE_JOB_TTL_HOURS", "1"))
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+def select_uploads(ids=None, uploaded_by=None, older_than_days=None, table_name=None):
+    """Return uploaded_files rows matching all of the given filters."""
+    clauses, params = [], {}
+    if ids:
+        clauses.append("id IN :ids")
+        params["ids"] = list(ids)
+    if uploaded_by:
+        clauses.append("uploaded_by = :uploaded_by")
+        params["uploaded_by"] = uploaded_by
+    if older_than_days is not None:
+        clauses.append("uploaded_at < :cutoff")
+        params["cutoff"] = datetime.now() - timedelta(days=older_than_days)
+    if table_name:
+        clauses.append("table_name = :table_name")
+        params["table_name"] = table_name
+    if not clauses:
+        raise ValueError("At least one of ids, uploaded_by or older_than_days is required")
+
+    stmt = text(f"""
+        SELECT id, filename, table_name, uploaded_at FROM uploaded_files
+        WHERE {" AND ".join(clauses)}
+        ORDER BY uploaded_at ASC
+    """)
+    if ids:
+        stmt = stmt.bindparams(bindparam("ids", expanding=True))
+    with engine.connect() as conn:
+        return [dict(row) for row in conn.execute(stmt, params).mappings().all()]
+
+def _remove_file(file_path):
+    """Delete a single upload from disk; returns True if a file was removed."""
+    try:
+        os.remove(file_path)
+        return True
+    except FileNotFoundError:
+        return False
+    except OSError as e:
+        logger.warning("⚠️ Could not remove %s: %s", file_path, e)
+        return False
+
+def _remove_source_files(uploaded_at_by_filename):
+    """Delete source files of already-deleted uploads that no remaining upload still references.
+
+    A file modified after the deleted upload's uploaded_at has been re-uploaded since
+    (possibly not parsed yet), so it is left in place.
+    """
+    if not uploaded_at_by_filename:
+        return 0
+    stmt = text("SELECT DISTINCT filename FROM uploaded_files WHERE filename IN :names")
+    stmt = stmt.bindparams(bindparam("names", expanding=True))
+    with engine.connect() as conn:
+        still_used = {row[0] for row in conn.execute(stmt, {"names": list(uploaded_at_by_filename)})}
+
+    removed = 0
+    for filename, uploaded_at in uploaded_at_by_filename.items():
+        if filename in still_used:
+            continue
+        file_path = os.path.join(UPLOAD_DIR, os.path.basename(filename))
+        try:
+            modified_at = datetime.fromtimestamp(os.path.getmtime(file_path))
+        except OSError:
+            continue
+        if uploaded_at and modified_at > uploaded_at:
+            continue
+        removed += _remove_file(file_path)
+    return removed
+
+def delete_uploads(rows, progress=None):
+    """Drop the tables, metadata rows and source files for the given uploads in batches.
+
+    Rows are re-read under lock at delete time, so a table_name filled in after selection is
+    still dropped, and uploads still being parsed are skipped rather than orphaning their table.
+    """
+    deleted, files_removed, skipped = 0, 0, 0
+    for start in range(0, len(rows), DELETE_BATCH_SIZE):
+        batch_ids = [row["id"] for row in rows[start:start + DELETE_BATCH_SIZE]]
+        grace_cutoff = datetime.now() - timedelta(minutes=PENDING_PARSE_GRACE_MINUTES)
+
+        with engine.begin() as conn:
+            locked = conn.execute(
+                text("""
+                    SELECT id, filename, table_name, uploaded_at FROM uploaded_files
+                    WHERE id IN :ids FOR UPDATE
+                """).bindparams(bindparam("ids", expanding=True)),
+                {"ids": batch_ids}
+            ).mappings().all()
+            batch = [
+                row for row in locked
+                if row["table_name"] or (row["uploaded_at"] and row["uploaded_at"] < grace_cutoff)
+            ]
+            if batch:
+                conn.execute(
+                    text("DELETE FROM uploaded_files WHERE id IN :ids").bindparams(bindparam("ids", expanding=True)),
+                    {"ids": [row["id"] for row in batch]}
+                )
+        skipped += len(locked) - len(batch)
+
+        # DROP TABLE commits implicitly in MySQL, so it runs only after the metadata delete has committed
+        tables = [row["table_name"] for row in batch if row["table_name"]]
+        if tables:
+            with engine.begin() as conn:
+                conn.execute(text("DROP TABLE IF EXISTS " + ", ".join(f"`{t}`" for t in tables)))
+
+        # Latest uploaded_at per filename, used to spot files re-uploaded since
+        uploaded_at_by_filename = {}
+        for row in batch:
+            if row["filename"]:
+                previous = uploaded_at_by_filename.get(row["filename"])
+                if previous is None or (row["uploaded_at"] and row["uploaded_at"] > previous):
+                    uploaded_at_by_filename[row["filename"]] = row["uploaded_at"]
+        files_removed += _remove_source_files(uploaded_at_by_filename)
+
+        deleted += len(batch)
+        if progress:
+            progress(deleted, files_removed, skipped)
+    return deleted, files_removed, skipped
+
+def drop_table(table_name):
+    """Drop a table that has no uploaded_files row."""
+    quoted = table_name.replace("`", "``")
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS `{quoted}`"))
+
+#---------------------------------------------------------------------------------------------
+# BACKGROUND JOBS
+#---------------------------------------------------------------------------------------------
+
+def create_deletion_job(rows, reason="manual"):
+    """Register a pending deletion job and return its public state."""
+    job = {
+        "job_id": uuid.uuid4().hex,
+        "reason": reason,
+        "status": "pending",
+        "total": len(rows),
+        "deleted": 0,
+        "files_removed": 0,
+        "skipped": 0,
+        "error": None,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "finished_at": None,
+    }
+    with _jobs_lock:
+        _prune_jobs()
+        _jobs[job["job_id"]] = job
+    return dict(job)
+
+def _prune_jobs():
+    """Drop finished jobs older than JOB_TTL_HOURS. Caller must hold _jobs_lock."""
+    cutoff = (datetime.now() - timedelta(hours=JOB_TTL_HOURS)).isoformat(timespec="seconds")
+    expired = [job_id for job_id, job in _jobs.items() if job["finished_at"] and job["finished_at"] < cutoff]
+    for job_id in expired:
+        del _jobs[job_id]
+
+def get_deletion_job(job_id):
+    with _jobs_lock:
+        _prune_jobs()
+        job = _jobs.get(job_id)
+        return dict(job) if job else None
+
+def _update_job(job_id, **fields):
+    with _jobs_lock:
+        _jobs[job_id].update(fields)
+
+def run_deletion_job(job_id, rows):
+    """Execute a registered deletion job, recording progress as each batch commits."""
+    _update_job(job_id, status="running")
+    try:
+        deleted, _, skipped = delete_uploads(
+            rows,
+            progress=lambda deleted, files, skipped: _update_job(
+                job_id, deleted=deleted, files_removed=files, skipped=skipped
+            ),
+        )
+        _update_job(job_id, status="done")
+        logger.info("🗑️ Deletion job %s removed %d uploads (%d skipped)", job_id, deleted, skipped)
+    except Exception as e:
+        logger.error("❌ Deletion job %s failed: %s", job_id, e, exc_info=True)
+        _update_job(job_id, status="error", error=str(e))
+    finally:
+        _update_job(job_id, finished_at=datetime.now().isoformat(timespec="seconds"))
+
+#---------------------------------------------------------------------------------------------
+# RETENTION
+#---------------------------------------------------------------------------------------------
+
+def remove_orphaned_files(days=RETENTION_DAYS):
+    """Delete files in UPLOAD_DIR older than `days` that no uploaded_files row references.
+
+    Catches files left by older single-table deletes and uploads that were never parsed.
+    """
+    cutoff = (datetime.now() - timedelta(days=days)).timestamp()
+    candidates = []
+    for entry in os.scandir(UPLOAD_DIR):
+        if entry.is_file() and entry.stat().st_mtime < cutoff:
+            candidates.append(entry.name)
+    if not candidates:
+        return 0
+
+    stmt = text("SELECT DISTINCT filename FROM uploaded_files WHERE filename IN :names")
+    stmt = stmt.bindparams(bindparam("names", expanding=True))
+    with engine.connect() as conn:
+        referenced = {row[0] for row in conn.execute(stmt, {"names": candidates})}
+
+    removed = sum(_remove_file(os.path.join(UPLOAD_DIR, name)) for name in candidates if name not in referenced)
+    if removed:
+        logger.info("🧹 Removed %d orphaned upload files", removed)
+    return removed
+
+def drop_orphaned_tables(days=RETENTION_DAYS):
+    """Drop data_ tables older than `days` that no uploaded_files row references.
+
+    Catches tables whose metadata row was deleted mid-parse or whose DROP failed after the delete.
+    """
+    cutoff = datetime.now() - timedelta(days=days)
+    with engine.connect() as conn:
+        candidates = [row[0] for row in conn.execute(text("""
+            SELECT table_name AS name FROM information_schema.tables
+            WHERE table_schema = DATABASE() AND table_name LIKE :pattern AND create_time < :cutoff
+        """), {"pattern": "data\\_%", "cutoff": cutoff})]
+        if not candidates:
+            return 0
+        stmt = text("SELECT DISTINCT table_name FROM uploaded_files WHERE table_name IN :names")
+        stmt = stmt.bindparams(bindparam("names", expanding=True))
+        referenced = {row[0] for row in conn.execute(stmt, {"names": candidates})}
+
+    orphans = [name for name in candidates if name not in referenced]
+    for name in orphans:
+        drop_table(name)
+    if orphans:
+        logger.info("🧹 Dropped %d orphaned data tables", len(orphans))
+    return len(orphans)
+
+def apply_retention_policy(days=RETENTION_DAYS):
+    """Reclaim every upload, orphaned table and orphaned file older than `days`; returns the job state, or None if no upload expired."""
+    job = None
+    rows = select_uploads(older_than_days=days)
+    if rows:
+        job = create_deletion_job(rows, reason="retention")
+        run_deletion_job(job["job_id"], rows)
+        job = get_deletion_job(job["job_id"])
+    drop_orphaned_tables(days)
+    remove_orphaned_files(days)
+    return job
+
+async def retention_loop():
+    logger.info("🧹 Retention policy active: reclaiming uploads older than %d days", RETENTION_DAYS)
+    while True:
+        try:
+            await asyncio.to_thread(apply_retention_policy)
+        except Exception as e:
+            logger.error("❌ Retention sweep failed: %s", e, exc_info=True)
+        await asyncio.sleep(RETENTION_INTERVAL_HOURS * 3600)
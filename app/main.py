@@ -1,13 +1,16 @@
-from fastapi import FastAPI, Request, UploadFile, File, Form, Query, HTTPException
+from fastapi import FastAPI, Request, UploadFile, File, Form, Query, HTTPException, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
 from starlette.middleware.sessions import SessionMiddleware
 from starlette.middleware import Middleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import RedirectResponse, HTMLResponse
 import os, shutil
+import asyncio
 import httpx
+from contextlib import asynccontextmanager
 import pandas as pd
-from app.db import slugify, insert_uploaded_file_metadata, insert_dynamic_table, engine
+from app.db import slugify, insert_uploaded_file_metadata, insert_dynamic_table, engine, UPLOAD_DIR
 from app.utils.llm_client import submit_llm_prompt, get_llm_response
 from sqlalchemy import text, inspect
 from app.middleware import AuthMiddleware
@@ -16,6 +19,10 @@ from app.utils.security import SESSION_SECRET
 from datetime import datetime
 from app.routes import analyze
 from app.logging_config import setup_logging
+from app.cleanup import (
+    select_uploads, delete_uploads, drop_table, create_deletion_job, run_deletion_job,
+    get_deletion_job, retention_loop, RETENTION_DAYS, MAX_AGE_DAYS,
+)
 
 setup_logging()  # ✅ Activate logging early
 
@@ -34,7 +41,6 @@ templates = Jinja2Templates(directory="templates")
 templates.env.globals["root_path"] = "/insight/"
 templates.env.globals["current_year"] = datetime.now().year
 
-UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 LLAMALITH_URL = "http://192.168.10.23:8000"
@@ -46,10 +52,57 @@ LLAMALITH_API_TOKEN = os.getenv("LLAMALITH_API_TOKEN")
 
 @insight_app.delete("/delete_table/{table_name}")
 async def delete_table(table_name: str):
-    with engine.begin() as conn:
-        conn.execute(text(f"DROP TABLE IF EXISTS {table_name}"))
-        conn.execute(text("DELETE FROM uploaded_files WHERE table_name = :tn"), {"tn": table_name})
+    rows = await run_in_threadpool(select_uploads, table_name=table_name)
+    if rows:
+        await run_in_threadpool(delete_uploads, rows)
+    else:
+        await run_in_threadpool(drop_table, table_name)
     return {"success": True}
+
+# Bulk delete by ids, uploader and/or age; runs in the background and reports progress
+@insight_app.post("/delete_tables")
+async def delete_tables(request: Request, background_tasks: BackgroundTasks):
+    try:
+        body = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Request body must be valid JSON")
+    if not isinstance(body, dict):
+        raise HTTPException(status_code=400, detail="Request body must be a JSON object")
+
+    ids = body.get("ids")
+    uploaded_by = body.get("uploaded_by")
+    older_than_days = body.get("older_than_days")
+
+    # bool is a subclass of int, so reject it explicitly
+    if ids is not None and (
+        not isinstance(ids, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids)
+    ):
+        raise HTTPException(status_code=400, detail="ids must be a list of integers")
+    if uploaded_by is not None and not isinstance(uploaded_by, str):
+        raise HTTPException(status_code=400, detail="uploaded_by must be a string")
+    if older_than_days is not None and (
+        not isinstance(older_than_days, int) or isinstance(older_than_days, bool)
+        or not 0 <= older_than_days <= MAX_AGE_DAYS
+    ):
+        raise HTTPException(status_code=400, detail=f"older_than_days must be an integer between 0 and {MAX_AGE_DAYS}")
+
+    try:
+        rows = await run_in_threadpool(
+            select_uploads, ids=ids or None, uploaded_by=uploaded_by or None, older_than_days=older_than_days
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    job = create_deletion_job(rows)
+    background_tasks.add_task(run_deletion_job, job["job_id"], rows)
+    return job
+
+@insight_app.get("/delete_tables/status/{job_id}")
+async def delete_tables_status(job_id: str):
+    job = get_deletion_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Deletion job not found")
+    return job
     
 #---------------------------------------------------------------------------------------------
 # GETS
@@ -147,7 +200,7 @@ async def manage_tables(request: Request):
     if not user:
         return RedirectResponse(url="/insight/login", status_code=303)
     with engine.connect() as conn:
-        result = conn.execute(text("SELECT table_name, uploaded_by, uploaded_at FROM uploaded_files ORDER BY uploaded_at ASC"))
+        result = conn.execute(text("SELECT id, table_name, uploaded_by, uploaded_at FROM uploaded_files ORDER BY uploaded_at ASC"))
         tables = result.mappings().all()
     return templates.TemplateResponse("manage.html", {"request": request, "user": user, "tables": tables})
 
@@ -349,7 +402,19 @@ async def ask_question(table_name: str, request: Request):
 
     return {"job_id": job_id}
 
-main_app = FastAPI()
+# Lifespan events are not forwarded to mounted apps, so the retention task lives on main_app
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    retention_task = asyncio.create_task(retention_loop()) if RETENTION_DAYS > 0 else None
+    yield
+    if retention_task:
+        retention_task.cancel()
+        try:
+            await retention_task
+        except asyncio.CancelledError:
+            pass
+
+main_app = FastAPI(lifespan=lifespan)
 main_app.mount("/insight", insight_app)
 
 @main_app.get("/")
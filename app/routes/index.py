@@ -2,11 +2,11 @@ from fastapi import APIRouter, Request, UploadFile, File
 from fastapi.responses import RedirectResponse
 from fastapi.templating import Jinja2Templates
 import os, shutil
+from app.db import UPLOAD_DIR
 
 templates = Jinja2Templates(directory="templates")
 router = APIRouter()
 
-UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 PREFIX = "/insight"